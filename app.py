@@ -2,8 +2,14 @@
 Streamlit application for insurance card validation and data extraction
 """
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from PIL import Image
+import copy
+import hashlib
 import io
+import threading
+from collections import OrderedDict
+from typing import Optional
 from insurance_validator import InsuranceCardProcessor
 from utils import convert_pdf_to_images, format_extraction_result
 import json
@@ -51,29 +57,185 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 
-def process_uploaded_file(uploaded_file) -> list:
+@st.cache_data(max_entries=16, show_spinner=False)
+def _decode(file_hash: str, file_type: str, _file_bytes: bytes) -> list:
+    """
+    Decode file bytes into PIL Images, cached by content hash
+    
+    Args:
+        file_hash: Hash of the file content, used as the cache key
+        file_type: MIME type of the file
+        _file_bytes: File content (excluded from Streamlit's own hashing)
+        
+    Returns:
+        List of PIL Image objects
+    """
+    if file_type == "application/pdf":
+        # Convert PDF to images
+        return convert_pdf_to_images(_file_bytes)
+    
+    # Load image directly
+    image = Image.open(io.BytesIO(_file_bytes))
+    image.load()
+    return [image]
+
+
+class _ResultCache:
+    """Process-wide LRU of successful processing results, keyed by image hash"""
+    
+    def __init__(self, max_entries: int = 16):
+        self._results = OrderedDict()
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+    
+    def get(self, key: tuple) -> Optional[dict]:
+        """Return a copy of the cached result for key, or None"""
+        with self._lock:
+            if key not in self._results:
+                return None
+            self._results.move_to_end(key)
+            return copy.deepcopy(self._results[key])
+    
+    def put(self, key: tuple, result: dict):
+        """Store a copy of result under key, evicting the oldest entry"""
+        with self._lock:
+            self._results[key] = copy.deepcopy(result)
+            self._results.move_to_end(key)
+            if len(self._results) > self._max_entries:
+                self._results.popitem(last=False)
+
+
+@st.cache_resource
+def _get_result_cache() -> _ResultCache:
+    """
+    Get the result cache shared by all sessions
+    
+    A plain cache is used instead of st.cache_data because processing
+    reports streaming progress to a placeholder created by the caller,
+    which st.cache_data cannot replay on a cache hit.
+    
+    Returns:
+        _ResultCache instance
+    """
+    return _ResultCache()
+
+
+def _process_images(
+    processor,
+    images: list,
+    skip_validation: bool,
+    on_progress=None
+) -> dict:
+    """
+    Run the insurance card processor, reusing results for identical images
+    
+    Only successful results are cached, so a retry after a failure or a
+    rejected card calls Bedrock again.
+    
+    Args:
+        processor: InsuranceCardProcessor instance
+        images: List of PIL Image objects
+        skip_validation: If True, skip validation step
+        on_progress: Optional callback receiving the number of streamed
+            characters; only called on a cache miss
+        
+    Returns:
+        Dictionary with validation and extraction results
+    """
+    cache = _get_result_cache()
+    key = (_hash_images(images), skip_validation)
+    
+    result = cache.get(key)
+    if result is not None:
+        return result
+    
+    result = processor.process_insurance_card(
+        images,
+        skip_validation=skip_validation,
+        on_progress=on_progress
+    )
+    if result.get("success"):
+        cache.put(key, result)
+    return result
+
+
+def _hash_images(images: list) -> str:
+    """
+    Compute a content hash over a list of PIL Images
+    
+    Args:
+        images: List of PIL Image objects
+        
+    Returns:
+        Hex digest of the image pixels and palettes
+    """
+    h = hashlib.blake2b()
+    for img in images:
+        h.update(f"{img.mode}{img.size}".encode())
+        h.update(img.tobytes())
+        
+        # Palette images store indices only; the palette decides the colors
+        palette = img.getpalette()
+        if palette is not None:
+            h.update(bytes(palette))
+    return h.hexdigest()
+
+
+def _preview(image: Image.Image) -> bytes:
+    """
+    Build a small JPEG preview of an image
+    
+    Streamlit sends images to the browser on every rerun, so previews are
+    downscaled and JPEG encoded instead of shipping the full-size PNG.
+    
+    Args:
+        image: PIL Image object
+        
+    Returns:
+        JPEG encoded preview bytes
+    """
+    preview = image.copy()
+    preview.thumbnail((800, 800))
+    if preview.mode not in ("RGB", "L"):
+        preview = preview.convert("RGB")
+    
+    buffered = io.BytesIO()
+    preview.save(buffered, format="JPEG", quality=80)
+    return buffered.getvalue()
+
+
+def process_uploaded_file(uploaded_file, key: str) -> list:
     """
     Process uploaded file and return list of PIL Images
     
+    The decoded images are kept in session state per uploader, so the
+    preview and the processing step share a single decode.
+    
     Args:
         uploaded_file: Streamlit UploadedFile object
+        key: Uploader key used to namespace session state entries
         
     Returns:
         List of PIL Image objects
     """
-    # Reset file pointer to beginning before reading
+    # Hash the upload in 1 MB chunks, so reruns with an unchanged file
+    # never materialize the whole file as a single bytes object
     uploaded_file.seek(0)
-    file_bytes = uploaded_file.read()
-    file_type = uploaded_file.type
+    hasher = hashlib.blake2b(digest_size=16)
+    while chunk := uploaded_file.read(1 << 20):
+        hasher.update(chunk)
+    file_hash = hasher.hexdigest()
     
-    if file_type == "application/pdf":
-        # Convert PDF to images
-        images = convert_pdf_to_images(file_bytes)
-        return images
-    else:
-        # Load image directly
-        image = Image.open(io.BytesIO(file_bytes))
-        return [image]
+    if st.session_state.get(f"{key}_hash") == file_hash:
+        return st.session_state[f"{key}_images"]
+    
+    # Only read the full file when it actually has to be decoded
+    uploaded_file.seek(0)
+    file_bytes = uploaded_file.read()
+    images = _decode(file_hash, uploaded_file.type, file_bytes)
+    st.session_state[f"{key}_hash"] = file_hash
+    st.session_state[f"{key}_images"] = images
+    return images
 
 
 def main():
@@ -111,12 +273,13 @@ def main():
             help="Upload the front side of the insurance card"
         )
         
+        front_images = None
         if front_file:
             st.success(f"✅ Uploaded: {front_file.name}")
             # Display preview
             try:
-                images = process_uploaded_file(front_file)
-                st.image(images[0], caption="Front Preview", use_container_width=True)
+                front_images = process_uploaded_file(front_file, "front")
+                st.image(_preview(front_images[0]), caption="Front Preview", use_container_width=True)
             except Exception as e:
                 st.error(f"Error previewing file: {str(e)}")
     
@@ -129,12 +292,13 @@ def main():
             help="Upload the back side for additional information"
         )
         
+        back_images = None
         if back_file:
             st.success(f"✅ Uploaded: {back_file.name}")
             # Display preview
             try:
-                images = process_uploaded_file(back_file)
-                st.image(images[0], caption="Back Preview", use_container_width=True)
+                back_images = process_uploaded_file(back_file, "back")
+                st.image(_preview(back_images[0]), caption="Back Preview", use_container_width=True)
             except Exception as e:
                 st.error(f"Error previewing file: {str(e)}")
     
@@ -158,24 +322,36 @@ def main():
     
     # Process when button is clicked
     if process_button and front_file:
+        progress = st.empty()
+        script_ctx = get_script_run_ctx()
+        
+        def show_progress(chars_received: int):
+            # Bedrock streams on a worker thread; attach it to this script run
+            add_script_run_ctx(threading.current_thread(), script_ctx)
+            progress.caption(f"Receiving extracted data... {chars_received} characters")
+        
         with st.spinner("Processing insurance card..."):
             try:
                 # Collect all images
                 all_images = []
                 
-                # Process front
-                front_images = process_uploaded_file(front_file)
+                # Reuse the images decoded for the previews
+                if front_images is None:
+                    front_images = process_uploaded_file(front_file, "front")
                 all_images.extend(front_images)
                 
-                # Process back if provided
+                # Add back if provided
                 if back_file:
-                    back_images = process_uploaded_file(back_file)
+                    if back_images is None:
+                        back_images = process_uploaded_file(back_file, "back")
                     all_images.extend(back_images)
                 
                 # Process with the insurance card processor
-                result = st.session_state.processor.process_insurance_card(
+                result = _process_images(
+                    st.session_state.processor,
                     all_images,
-                    skip_validation=skip_validation
+                    skip_validation,
+                    show_progress
                 )
                 
                 # Store result in session state
@@ -184,6 +360,8 @@ def main():
             except Exception as e:
                 st.error(f"Error processing card: {str(e)}")
                 st.session_state.last_result = None
+        
+        progress.empty()
     
     # Display results
     if 'last_result' in st.session_state and st.session_state.last_result:
@@ -1,12 +1,39 @@
 """
 AWS Bedrock client for invoking Claude models with vision capabilities
 """
-import json
+import asyncio
 import boto3
-from typing import Dict, Any, Optional
+from botocore.config import Config
+from functools import lru_cache
+from typing import Dict, Any, Callable, Iterator, Optional
 from config import AWS_REGION, MODEL_ID, MAX_TOKENS, TEMPERATURE
 
 
+@lru_cache(maxsize=4)
+def _get_client(region_name: str):
+    """
+    Get a shared bedrock-runtime client for the region
+    
+    boto3 clients are thread-safe, so a single client (and its pool of
+    kept-alive TLS connections) is reused across processors and calls.
+    
+    Args:
+        region_name: AWS region
+        
+    Returns:
+        boto3 bedrock-runtime client
+    """
+    return boto3.client(
+        'bedrock-runtime',
+        region_name=region_name,
+        config=Config(
+            max_pool_connections=32,
+            tcp_keepalive=True,
+            retries={'mode': 'adaptive', 'max_attempts': 3}
+        )
+    )
+
+
 class BedrockClient:
     """Client for interacting with AWS Bedrock"""
     
@@ -20,12 +47,35 @@ class BedrockClient:
         """
         self.region_name = region_name
         self.model_id = model_id
-        self.client = boto3.client('bedrock-runtime', region_name=region_name)
+        self.client = _get_client(region_name)
+    
+    def _build_messages(self, prompt: str, images_bytes: list) -> list:
+        """
+        Build a Converse API message with images followed by the prompt
+        
+        Args:
+            prompt: Text prompt
+            images_bytes: List of JPEG encoded images as raw bytes
+            
+        Returns:
+            List of Converse API messages
+        """
+        # Converse uses one message schema for every model, so no
+        # Anthropic-specific request body has to be assembled here
+        content = [
+            {"image": {"format": "jpeg", "source": {"bytes": image_bytes}}}
+            for image_bytes in images_bytes
+        ]
+        
+        # Add text prompt at the end
+        content.append({"text": prompt})
+        
+        return [{"role": "user", "content": content}]
     
     def invoke_with_image(
         self, 
         prompt: str, 
-        image_base64: str,
+        image_bytes: bytes,
         max_tokens: int = MAX_TOKENS,
         temperature: float = TEMPERATURE
     ) -> str:
@@ -34,125 +84,172 @@ class BedrockClient:
         
         Args:
             prompt: Text prompt
-            image_base64: Base64 encoded image
+            image_bytes: JPEG encoded image as raw bytes
             max_tokens: Maximum tokens in response
             temperature: Temperature for generation
             
         Returns:
             Model response text
         """
-        # Construct message for Claude
-        message = {
-            "role": "user",
-            "content": [
-                {
-                    "type": "image",
-                    "source": {
-                        "type": "base64",
-                        "media_type": "image/png",
-                        "data": image_base64
-                    }
-                },
-                {
-                    "type": "text",
-                    "text": prompt
-                }
-            ]
-        }
-        
-        # Prepare request body
-        request_body = {
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": max_tokens,
-            "temperature": temperature,
-            "messages": [message]
-        }
+        return self.invoke_with_multiple_images(
+            prompt, [image_bytes], max_tokens, temperature
+        )
+    
+    def invoke_with_multiple_images(
+        self,
+        prompt: str,
+        images_bytes: list,
+        max_tokens: int = MAX_TOKENS,
+        temperature: float = TEMPERATURE
+    ) -> str:
+        """
+        Invoke Claude model with multiple images (e.g., front and back of card)
         
+        Args:
+            prompt: Text prompt
+            images_bytes: List of JPEG encoded images as raw bytes
+            max_tokens: Maximum tokens in response
+            temperature: Temperature for generation
+            
+        Returns:
+            Model response text
+        """
         try:
             # Invoke model
-            response = self.client.invoke_model(
+            response = self.client.converse(
                 modelId=self.model_id,
-                body=json.dumps(request_body)
+                messages=self._build_messages(prompt, images_bytes),
+                inferenceConfig={"maxTokens": max_tokens, "temperature": temperature}
             )
             
-            # Parse response
-            response_body = json.loads(response['body'].read())
-            
             # Extract text from response
-            if 'content' in response_body and len(response_body['content']) > 0:
-                return response_body['content'][0]['text']
-            else:
-                raise ValueError("No content in model response")
+            for block in response['output']['message']['content']:
+                if 'text' in block:
+                    return block['text']
+            raise ValueError("No content in model response")
                 
         except Exception as e:
             raise RuntimeError(f"Bedrock API call failed: {str(e)}")
     
-    def invoke_with_multiple_images(
+    def invoke_with_images_stream(
         self,
         prompt: str,
-        images_base64: list,
+        images_bytes: list,
+        on_progress: Optional[Callable[[int], None]] = None,
         max_tokens: int = MAX_TOKENS,
         temperature: float = TEMPERATURE
     ) -> str:
         """
-        Invoke Claude model with multiple images (e.g., front and back of card)
+        Invoke Claude model with one or more images, streaming the response
         
         Args:
             prompt: Text prompt
-            images_base64: List of base64 encoded images
+            images_bytes: List of JPEG encoded images as raw bytes
+            on_progress: Optional callback invoked with the number of
+                characters received so far after every streamed chunk
             max_tokens: Maximum tokens in response
             temperature: Temperature for generation
             
         Returns:
             Model response text
         """
-        # Build content list with all images
-        content = []
-        
-        for idx, image_base64 in enumerate(images_base64):
-            content.append({
-                "type": "image",
-                "source": {
-                    "type": "base64",
-                    "media_type": "image/png",
-                    "data": image_base64
-                }
-            })
-        
-        # Add text prompt at the end
-        content.append({
-            "type": "text",
-            "text": prompt
-        })
-        
-        message = {
-            "role": "user",
-            "content": content
-        }
-        
-        # Prepare request body
-        request_body = {
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": max_tokens,
-            "temperature": temperature,
-            "messages": [message]
-        }
-        
         try:
             # Invoke model
-            response = self.client.invoke_model(
+            response = self.client.converse_stream(
                 modelId=self.model_id,
-                body=json.dumps(request_body)
+                messages=self._build_messages(prompt, images_bytes),
+                inferenceConfig={"maxTokens": max_tokens, "temperature": temperature}
             )
+        except Exception as e:
+            raise RuntimeError(f"Bedrock API call failed: {str(e)}")
+        
+        # Accumulate text deltas as they arrive; the callback runs outside
+        # the stream's error handling so its own errors propagate unchanged
+        parts = []
+        received = 0
+        for text in self._iter_stream_text(response):
+            parts.append(text)
+            received += len(text)
+            if on_progress is not None:
+                on_progress(received)
+        
+        if not parts:
+            raise RuntimeError("Bedrock API call failed: No content in model response")
+        return ''.join(parts)
+    
+    @staticmethod
+    def _iter_stream_text(response: Dict[str, Any]) -> Iterator[str]:
+        """
+        Yield the text deltas of a converse_stream response
+        
+        Args:
+            response: converse_stream response
             
-            # Parse response
-            response_body = json.loads(response['body'].read())
-            
-            # Extract text from response
-            if 'content' in response_body and len(response_body['content']) > 0:
-                return response_body['content'][0]['text']
-            else:
-                raise ValueError("No content in model response")
-                
+        Yields:
+            Text chunks in the order they were generated
+        """
+        try:
+            for event in response['stream']:
+                if 'contentBlockDelta' in event:
+                    yield event['contentBlockDelta']['delta'].get('text', '')
         except Exception as e:
             raise RuntimeError(f"Bedrock API call failed: {str(e)}")
+    
+    async def ainvoke_with_image(
+        self,
+        prompt: str,
+        image_bytes: bytes,
+        max_tokens: int = MAX_TOKENS,
+        temperature: float = TEMPERATURE
+    ) -> str:
+        """
+        Async variant of invoke_with_image
+        
+        The blocking boto3 call runs in a worker thread so several
+        requests can be in flight at the same time.
+        
+        Args:
+            prompt: Text prompt
+            image_bytes: JPEG encoded image as raw bytes
+            max_tokens: Maximum tokens in response
+            temperature: Temperature for generation
+            
+        Returns:
+            Model response text
+        """
+        return await asyncio.to_thread(
+            self.invoke_with_image, prompt, image_bytes, max_tokens, temperature
+        )
+    
+    async def ainvoke_with_images_stream(
+        self,
+        prompt: str,
+        images_bytes: list,
+        on_progress: Optional[Callable[[int], None]] = None,
+        max_tokens: int = MAX_TOKENS,
+        temperature: float = TEMPERATURE
+    ) -> str:
+        """
+        Async variant of invoke_with_images_stream
+        
+        Note that on_progress is called from the worker thread.
+        
+        Args:
+            prompt: Text prompt
+            images_bytes: List of JPEG encoded images as raw bytes
+            on_progress: Optional callback invoked with the number of
+                characters received so far
+            max_tokens: Maximum tokens in response
+            temperature: Temperature for generation
+            
+        Returns:
+            Model response text
+        """
+        return await asyncio.to_thread(
+            self.invoke_with_images_stream,
+            prompt,
+            images_bytes,
+            on_progress,
+            max_tokens,
+            temperature
+        )
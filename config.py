@@ -15,30 +15,24 @@ MODEL_ID = os.getenv("MODEL_ID", "anthropic.claude-3-5-sonnet-20240620-v1:0")
 MAX_TOKENS = 4096
 TEMPERATURE = 0.0  # Use 0 for deterministic output
 
-# Validation Prompt
-VALIDATION_PROMPT = """You are an expert at identifying insurance cards. 
-Analyze this image and determine if it is an insurance card (health/medical insurance).
+# Image parameters
+PDF_DPI = 150  # Enough for OCR on card-sized documents
+MAX_IMAGE_DIMENSION = 1568  # Claude downsamples anything larger
+JPEG_QUALITY = 85
+
+# Local pre-check: images scoring below this are rejected without calling Bedrock
+CARD_HEURISTIC_THRESHOLD = 0.1
 
-Look for these characteristics:
+# Prompt building blocks, shared by the prompts below
+_CARD_CHARACTERISTICS = """Look for these characteristics:
 - Insurance company name/logo
 - Member ID or Subscriber ID
 - Group number
 - Plan information
 - Coverage details
-- Medical insurance terminology
-
-Respond ONLY with a JSON object in this exact format:
-{
-    "is_insurance_card": true or false,
-    "confidence": "high" or "medium" or "low",
-    "reason": "Brief explanation of your decision"
-}"""
-
-# Extraction Prompt
-EXTRACTION_PROMPT = """You are an expert at extracting information from insurance cards.
-Extract all relevant information from this insurance card image.
+- Medical insurance terminology"""
 
-Required fields to extract (if visible):
+_EXTRACTION_FIELDS = """Required fields to extract (if visible):
 1. Insurance Company Name
 2. Member/Patient Name
 3. Member ID (or Subscriber ID or ID#)
@@ -49,10 +43,13 @@ Also extract any additional useful information like:
 - Plan Type (PPO, HMO, etc.)
 - RxBin, RxPCN, RxGrp (pharmacy information)
 - Copay information
-- Contact phone numbers
+- Contact phone numbers"""
 
-Respond ONLY with a JSON object in this exact format:
-{
+_VALIDATION_FIELDS_SCHEMA = '''"is_insurance_card": true or false,
+"confidence": "high" or "medium" or "low",
+"reason": "Brief explanation of your decision"'''
+
+_EXTRACTION_SCHEMA = """{
     "insurance_company": "company name or null",
     "member_name": "name or null",
     "member_id": "ID or null",
@@ -63,7 +60,55 @@ Respond ONLY with a JSON object in this exact format:
         "pharmacy_info": {},
         "other_details": {}
     }
-}
+}"""
+
+_NULL_FIELDS_NOTE = "If a field is not visible or cannot be determined, use null."
+
+
+def _indent(text: str, prefix: str = "    ") -> str:
+    """Indent every line after the first, for nesting in a prompt's JSON"""
+    return text.replace("\n", "\n" + prefix)
+
+
+# Validation Prompt
+VALIDATION_PROMPT = f"""You are an expert at identifying insurance cards. 
+Analyze this image and determine if it is an insurance card (health/medical insurance).
+
+{_CARD_CHARACTERISTICS}
+
+Respond ONLY with a JSON object in this exact format:
+{{
+    {_indent(_VALIDATION_FIELDS_SCHEMA)}
+}}"""
+
+# Extraction Prompt
+EXTRACTION_PROMPT = f"""You are an expert at extracting information from insurance cards.
+Extract all relevant information from this insurance card image.
+
+{_EXTRACTION_FIELDS}
+
+Respond ONLY with a JSON object in this exact format:
+{_EXTRACTION_SCHEMA}
+
+{_NULL_FIELDS_NOTE}
+"""
+
+# Combined validation + extraction prompt (one Bedrock call instead of two)
+COMBINED_PROMPT = f"""You are an expert at identifying insurance cards and extracting their information.
+First determine if this image is an insurance card (health/medical insurance).
+
+{_CARD_CHARACTERISTICS}
+
+If it is an insurance card, extract all relevant information from it.
+
+{_EXTRACTION_FIELDS}
+
+Respond ONLY with a JSON object in this exact format:
+{{
+    {_indent(_VALIDATION_FIELDS_SCHEMA)},
+    "extraction": {_indent(_EXTRACTION_SCHEMA)}
+}}
 
-If a field is not visible or cannot be determined, use null.
+If it is not an insurance card, set every extraction field to null.
+{_NULL_FIELDS_NOTE}
 """
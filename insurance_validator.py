@@ -1,11 +1,22 @@
 """
 Insurance card validation and data extraction
 """
-from typing import Dict, List, Optional
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
 from PIL import Image
 from bedrock_client import BedrockClient
-from utils import encode_image, parse_json_response
-from config import VALIDATION_PROMPT, EXTRACTION_PROMPT
+from utils import image_to_bytes, parse_json_response, quick_card_heuristic
+from config import (
+    VALIDATION_PROMPT,
+    EXTRACTION_PROMPT,
+    COMBINED_PROMPT,
+    CARD_HEURISTIC_THRESHOLD
+)
+
+# Shared by every processor; one is created per Streamlit session, so a
+# per-instance pool would leave idle threads behind for each session
+_ENCODE_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="encode")
 
 
 class InsuranceCardProcessor:
@@ -21,25 +32,94 @@ class InsuranceCardProcessor:
         
         Args:
             image: PIL Image object
-            
+        
+        Returns:
+            Dictionary with validation results
+        """
+        rejection = self._local_rejection(image)
+        if rejection is not None:
+            return rejection
+        
+        return asyncio.run(self._validate_async(self._encode_images([image])[0]))
+    
+    def extract_card_data(
+        self,
+        images: List[Image.Image],
+        on_progress: Optional[Callable[[int], None]] = None
+    ) -> Dict:
+        """
+        Extract data from insurance card images (front and/or back)
+        
+        Args:
+            images: List of PIL Image objects (typically front and back)
+            on_progress: Optional callback receiving the number of response
+                characters streamed so far
+        
+        Returns:
+            Dictionary with extracted data
+        """
+        return asyncio.run(self._extract_async(self._encode_images(images), on_progress))
+    
+    @staticmethod
+    def _local_rejection(image: Image.Image) -> Optional[Dict]:
+        """
+        Reject obvious non-cards locally, without a Bedrock call
+        
+        Args:
+            image: PIL Image object
+        
+        Returns:
+            Validation results if the image is rejected, otherwise None
+        """
+        if quick_card_heuristic(image) >= CARD_HEURISTIC_THRESHOLD:
+            return None
+        
+        return {
+            "is_insurance_card": False,
+            "confidence": "high",
+            "reason": "Failed local heuristic (blank page or implausible shape)"
+        }
+    
+    def _encode_images(self, images: List[Image.Image]) -> List[Future]:
+        """
+        Start encoding images on the shared thread pool
+        
+        PIL releases the GIL while saving, so the front and back images are
+        encoded in parallel with each other rather than one after another.
+        
+        Args:
+            images: List of PIL Image objects
+        
+        Returns:
+            List of futures resolving to JPEG encoded image bytes
+        """
+        return [_ENCODE_POOL.submit(image_to_bytes, img, "JPEG") for img in images]
+    
+    async def _validate_async(self, encoded_image: Future) -> Dict:
+        """
+        Validate if the image is an insurance card without blocking the event loop
+        
+        Args:
+            encoded_image: Future resolving to the JPEG encoded image bytes
+        
         Returns:
             Dictionary with validation results
         """
         try:
-            # Encode image
-            image_b64 = encode_image(image)
+            # Wait for the image encoding
+            image_bytes = await asyncio.wrap_future(encoded_image)
             
             # Call Bedrock
-            response = self.bedrock_client.invoke_with_image(
+            response = await self.bedrock_client.ainvoke_with_image(
                 prompt=VALIDATION_PROMPT,
-                image_base64=image_b64
+                image_bytes=image_bytes
             )
             
             # Parse JSON response
             result = parse_json_response(response)
             
             return result
-            
+        
         except Exception as e:
             return {
                 "is_insurance_card": False,
@@ -47,62 +127,143 @@ class InsuranceCardProcessor:
                 "reason": f"Error during validation: {str(e)}"
             }
     
-    def extract_card_data(self, images: List[Image.Image]) -> Dict:
+    async def _extract_async(
+        self,
+        encoded_images: List[Future],
+        on_progress: Optional[Callable[[int], None]] = None
+    ) -> Dict:
         """
-        Extract data from insurance card images (front and/or back)
+        Extract data from insurance card images without blocking the event loop
         
         Args:
-            images: List of PIL Image objects (typically front and back)
-            
+            encoded_images: Futures resolving to the JPEG encoded image bytes
+                (typically front and back)
+            on_progress: Optional callback receiving the number of response
+                characters streamed so far
+        
         Returns:
             Dictionary with extracted data
         """
         try:
-            # Encode all images
-            images_b64 = [encode_image(img) for img in images]
-            
-            # Build prompt with context about multiple images
-            if len(images) > 1:
-                context_prompt = (
-                    f"{EXTRACTION_PROMPT}\n\n"
-                    f"Note: You are analyzing {len(images)} images of the same insurance card "
-                    f"(likely front and back). Combine information from all images."
-                )
-            else:
-                context_prompt = EXTRACTION_PROMPT
+            # Collect the encoded images just before the API call
+            images_bytes = await asyncio.gather(
+                *(asyncio.wrap_future(f) for f in encoded_images)
+            )
             
-            # Call Bedrock with all images
-            if len(images) == 1:
-                response = self.bedrock_client.invoke_with_image(
-                    prompt=context_prompt,
-                    image_base64=images_b64[0]
-                )
-            else:
-                response = self.bedrock_client.invoke_with_multiple_images(
-                    prompt=context_prompt,
-                    images_base64=images_b64
-                )
+            # Call Bedrock with all images, streaming the long extraction output
+            response = await self.bedrock_client.ainvoke_with_images_stream(
+                prompt=self._with_image_context(EXTRACTION_PROMPT, len(images_bytes)),
+                images_bytes=list(images_bytes),
+                on_progress=on_progress
+            )
             
             # Parse JSON response
             result = parse_json_response(response)
             
             return result
+        
+        except Exception as e:
+            return self._failed_extraction(e)
+    
+    async def _combined_async(
+        self,
+        encoded_images: List[Future],
+        on_progress: Optional[Callable[[int], None]] = None
+    ) -> Tuple[Dict, Optional[Dict]]:
+        """
+        Validate and extract in a single Bedrock call
+        
+        Args:
+            encoded_images: Futures resolving to the JPEG encoded image bytes
+                (typically front and back)
+            on_progress: Optional callback receiving the number of response
+                characters streamed so far
+        
+        Returns:
+            Tuple of (validation results, extracted data); extracted data is
+            None when the images are not an insurance card
+        """
+        try:
+            images_bytes = await asyncio.gather(
+                *(asyncio.wrap_future(f) for f in encoded_images)
+            )
+            
+            response = await self.bedrock_client.ainvoke_with_images_stream(
+                prompt=self._with_image_context(COMBINED_PROMPT, len(images_bytes)),
+                images_bytes=list(images_bytes),
+                on_progress=on_progress
+            )
+            
+            result = parse_json_response(response)
             
         except Exception as e:
             return {
-                "error": f"Failed to extract data: {str(e)}",
-                "insurance_company": None,
-                "member_name": None,
-                "member_id": None,
-                "group_number": None,
-                "effective_date": None,
-                "additional_info": {}
-            }
+                "is_insurance_card": False,
+                "confidence": "low",
+                "reason": f"Error during validation: {str(e)}"
+            }, None
+        
+        # Split the combined response into its two parts
+        validation = {
+            "is_insurance_card": result.get("is_insurance_card", False),
+            "confidence": result.get("confidence", "low"),
+            "reason": result.get("reason", "N/A")
+        }
+        if not validation["is_insurance_card"]:
+            return validation, None
+        
+        extraction = result.get("extraction")
+        if not isinstance(extraction, dict):
+            extraction = self._failed_extraction("No extraction in model response")
+        
+        return validation, extraction
+    
+    @staticmethod
+    def _with_image_context(prompt: str, image_count: int) -> str:
+        """
+        Add a note about multiple images of the same card to a prompt
+        
+        Args:
+            prompt: Base prompt
+            image_count: Number of images sent with the prompt
+        
+        Returns:
+            Prompt to send to the model
+        """
+        if image_count > 1:
+            return (
+                f"{prompt}\n\n"
+                f"Note: You are analyzing {image_count} images of the same insurance card "
+                f"(likely front and back). Combine information from all images."
+            )
+        return prompt
+    
+    @staticmethod
+    def _failed_extraction(error) -> Dict:
+        """
+        Build the extraction result returned when extraction fails
+        
+        Args:
+            error: Exception or message describing the failure
+        
+        Returns:
+            Dictionary with an error message and empty fields
+        """
+        return {
+            "error": f"Failed to extract data: {str(error)}",
+            "insurance_company": None,
+            "member_name": None,
+            "member_id": None,
+            "group_number": None,
+            "effective_date": None,
+            "additional_info": {}
+        }
     
     def process_insurance_card(
-        self, 
+        self,
         images: List[Image.Image],
-        skip_validation: bool = False
+        skip_validation: bool = False,
+        on_progress: Optional[Callable[[int], None]] = None
     ) -> Dict:
         """
         Complete workflow: validate and extract data from insurance card
@@ -110,7 +271,32 @@ class InsuranceCardProcessor:
         Args:
             images: List of PIL Image objects
             skip_validation: If True, skip validation step
-            
+            on_progress: Optional callback receiving the number of response
+                characters streamed so far (called from a worker thread)
+        
+        Returns:
+            Dictionary with validation and extraction results
+        """
+        return asyncio.run(self._process_async(images, skip_validation, on_progress))
+    
+    async def _process_async(
+        self,
+        images: List[Image.Image],
+        skip_validation: bool = False,
+        on_progress: Optional[Callable[[int], None]] = None
+    ) -> Dict:
+        """
+        Run the complete workflow on the event loop
+        
+        Validation and extraction share a single Bedrock call, so the
+        images are uploaded and processed by the model only once.
+        
+        Args:
+            images: List of PIL Image objects
+            skip_validation: If True, skip validation step
+            on_progress: Optional callback receiving the number of response
+                characters streamed so far
+        
         Returns:
             Dictionary with validation and extraction results
         """
@@ -120,19 +306,28 @@ class InsuranceCardProcessor:
             "success": False
         }
         
-        # Validate first image (front of card)
+        # Blank pages and the like never reach Bedrock
         if not skip_validation:
-            validation = self.validate_insurance_card(images[0])
+            rejection = self._local_rejection(images[0])
+            if rejection is not None:
+                result["validation"] = rejection
+                result["error"] = "Not an insurance card"
+                return result
+        
+        encoded_images = self._encode_images(images)
+        
+        if skip_validation:
+            extraction = await self._extract_async(encoded_images, on_progress)
+        else:
+            validation, extraction = await self._combined_async(encoded_images, on_progress)
             result["validation"] = validation
             
-            # If not an insurance card, don't proceed with extraction
+            # If not an insurance card, there is nothing to extract
             if not validation.get("is_insurance_card", False):
                 result["success"] = False
                 result["error"] = "Not an insurance card"
                 return result
         
-        # Extract data from all images
-        extraction = self.extract_card_data(images)
         result["extraction"] = extraction
         result["success"] = "error" not in extraction
         
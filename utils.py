@@ -2,51 +2,223 @@
 Utility functions for image processing and data parsing
 """
 import base64
+import hashlib
 import io
 import json
+import re
+import threading
+from collections import OrderedDict
 from typing import List, Optional
-from PIL import Image
-from pdf2image import convert_from_bytes
+from PIL import Image, ImageStat
+from config import PDF_DPI, MAX_IMAGE_DIMENSION, JPEG_QUALITY
 
+try:
+    # pypdfium2 renders in-process; pdf2image shells out to poppler
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+    from pdf2image import convert_from_bytes
 
-def convert_pdf_to_images(pdf_bytes: bytes, dpi: int = 300) -> List[Image.Image]:
+try:
+    # orjson is an optional, faster drop-in for json.loads
+    from orjson import loads as _json_loads
+except ImportError:
+    _json_loads = json.loads
+
+# PDFium is not thread-safe, even across documents, and Streamlit runs
+# each browser session on its own thread
+_PDFIUM_LOCK = threading.Lock()
+
+# JSON object inside a markdown code block, ending at the closing fence
+_FENCED_JSON_RE = re.compile(r"```(?:json)?\s*(\{.*?\})\s*```", re.DOTALL)
+
+# Outermost JSON object anywhere in the text
+_JSON_RE = re.compile(r"(\{.*\})", re.DOTALL)
+
+# LRU cache of encoded image bytes, keyed by pixel hash; shared by worker threads
+_ENCODE_CACHE: "OrderedDict[tuple, bytes]" = OrderedDict()
+_ENCODE_CACHE_SIZE = 32
+_ENCODE_CACHE_LOCK = threading.Lock()
+
+
+def convert_pdf_to_images(pdf_bytes: bytes, dpi: int = PDF_DPI) -> List[Image.Image]:
     """
     Convert PDF bytes to a list of PIL Images
     
     Args:
         pdf_bytes: PDF file content as bytes
-        dpi: Resolution for conversion (default 300)
+        dpi: Resolution for conversion (default 150)
         
     Returns:
         List of PIL Image objects
     """
     try:
-        images = convert_from_bytes(pdf_bytes, dpi=dpi)
-        return images
+        if pdfium is None:
+            return convert_from_bytes(pdf_bytes, dpi=dpi)
+        
+        with _PDFIUM_LOCK:
+            pdf = pdfium.PdfDocument(pdf_bytes)
+            try:
+                images = []
+                for page in pdf:
+                    try:
+                        # PDF user space is 72 points per inch
+                        images.append(page.render(scale=dpi / 72).to_pil())
+                    finally:
+                        page.close()
+                return images
+            finally:
+                pdf.close()
     except Exception as e:
         raise ValueError(f"Failed to convert PDF to images: {str(e)}")
 
 
-def encode_image(image: Image.Image, format: str = "PNG") -> str:
+def image_to_bytes(image: Image.Image, format: str = "JPEG") -> bytes:
+    """
+    Encode PIL Image to raw image file bytes
+    
+    Images larger than MAX_IMAGE_DIMENSION are downscaled first, since
+    Claude resizes them anyway and the extra pixels only cost upload time.
+    
+    Results are cached by pixel content. The app's result cache already
+    catches repeat clicks on the same card, so this cache only pays off
+    when the same images are sent again without a cached result: after
+    toggling "Skip validation", when retrying a failed or rejected card,
+    or when validate_insurance_card and extract_card_data are called
+    separately on the same images. Each call still hashes the full
+    resolution pixels, which is much cheaper than a resize and encode.
+    
+    Args:
+        image: PIL Image object
+        format: Image format (JPEG, PNG, etc.)
+        
+    Returns:
+        Encoded image bytes
+    """
+    hasher = hashlib.blake2b(image.tobytes(), digest_size=16)
+    
+    # Palette images store indices only; the palette decides the colors
+    palette = image.getpalette()
+    if palette is not None:
+        hasher.update(bytes(palette))
+    
+    key = (hasher.digest(), image.mode, image.size, format.upper())
+    
+    with _ENCODE_CACHE_LOCK:
+        if key in _ENCODE_CACHE:
+            _ENCODE_CACHE.move_to_end(key)
+            return _ENCODE_CACHE[key]
+    
+    image_bytes = _image_to_bytes_uncached(image, format)
+    
+    with _ENCODE_CACHE_LOCK:
+        _ENCODE_CACHE[key] = image_bytes
+        if len(_ENCODE_CACHE) > _ENCODE_CACHE_SIZE:
+            _ENCODE_CACHE.popitem(last=False)
+    
+    return image_bytes
+
+
+def _image_to_bytes_uncached(image: Image.Image, format: str) -> bytes:
+    """
+    Downscale and encode PIL Image to raw bytes, bypassing the cache
+    
+    Args:
+        image: PIL Image object
+        format: Image format (JPEG, PNG, etc.)
+        
+    Returns:
+        Encoded image bytes
+    """
+    if format.upper() == "JPEG":
+        # JPEG is 8-bit only; rescale instead of clipping to white
+        image = _to_8bit(image)
+    
+    if max(image.size) > MAX_IMAGE_DIMENSION:
+        image = image.copy()
+        image.thumbnail((MAX_IMAGE_DIMENSION, MAX_IMAGE_DIMENSION), Image.LANCZOS)
+    
+    buffered = io.BytesIO()
+    
+    if format.upper() == "JPEG":
+        # JPEG has no alpha or palette support
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.save(buffered, format=format, quality=JPEG_QUALITY, optimize=True)
+    else:
+        image.save(buffered, format=format)
+    
+    return buffered.getvalue()
+
+
+def encode_image(image: Image.Image, format: str = "JPEG") -> str:
     """
     Encode PIL Image to base64 string
     
     Args:
         image: PIL Image object
-        format: Image format (PNG, JPEG, etc.)
+        format: Image format (JPEG, PNG, etc.)
         
     Returns:
         Base64 encoded string
     """
-    buffered = io.BytesIO()
+    return base64.b64encode(image_to_bytes(image, format)).decode('utf-8')
+
+
+def _to_8bit(image: Image.Image) -> Image.Image:
+    """
+    Rescale high bit depth grayscale images (I;16, I, F) to 8-bit
     
-    # Convert RGBA to RGB if saving as JPEG
-    if format.upper() == "JPEG" and image.mode == "RGBA":
-        image = image.convert("RGB")
+    Converting these modes straight to L or RGB clips every value above
+    255 to white, which wipes out the content of 16-bit scanner output.
+    The pixel range is stretched to 0-255 instead.
     
-    image.save(buffered, format=format)
-    img_bytes = buffered.getvalue()
-    return base64.b64encode(img_bytes).decode('utf-8')
+    Args:
+        image: PIL Image object
+        
+    Returns:
+        8-bit L image for high bit depth input, otherwise the image unchanged
+    """
+    if image.mode.startswith("I;16"):
+        image = image.convert("I")
+    if image.mode not in ("I", "F"):
+        return image
+    
+    low, high = image.getextrema()
+    scale = 255.0 / (high - low) if high > low else 0.0
+    offset = -low * scale
+    return image.point(lambda v: v * scale + offset).convert("L")
+
+
+def quick_card_heuristic(image: Image.Image) -> float:
+    """
+    Cheaply score how plausible it is that an image shows an insurance card
+    
+    Only obvious non-cards score near 0: blank or near-uniform pages and
+    extreme strip-like aspect ratios. Anything with printed content scores
+    high and is left for the model to decide.
+    
+    Args:
+        image: PIL Image object
+        
+    Returns:
+        Score between 0.0 (certainly not a card) and 1.0
+    """
+    width, height = image.size
+    if width == 0 or height == 0:
+        return 0.0
+    
+    # Cards are ~1.6:1 and scanned pages ~1.4:1; long strips are neither
+    if max(width, height) / min(width, height) > 4:
+        return 0.0
+    
+    # Measure contrast on a small grayscale copy
+    small = _to_8bit(image).copy()
+    small.thumbnail((256, 256))
+    stddev = ImageStat.Stat(small.convert("L")).stddev[0]
+    
+    # Text and logos push the stddev well above 20; a blank page is near 0
+    return min(stddev / 20.0, 1.0)
 
 
 def encode_image_from_bytes(image_bytes: bytes) -> str:
@@ -75,27 +247,15 @@ def parse_json_response(response_text: str) -> dict:
     """
     try:
         # Try direct JSON parsing
-        return json.loads(response_text)
-    except json.JSONDecodeError:
-        # Try to extract JSON from markdown code blocks
-        if "```json" in response_text:
-            start = response_text.find("```json") + 7
-            end = response_text.find("```", start)
-            json_text = response_text[start:end].strip()
-            return json.loads(json_text)
-        elif "```" in response_text:
-            start = response_text.find("```") + 3
-            end = response_text.find("```", start)
-            json_text = response_text[start:end].strip()
-            return json.loads(json_text)
-        else:
-            # Try to find JSON-like structure
-            start = response_text.find("{")
-            end = response_text.rfind("}") + 1
-            if start != -1 and end != 0:
-                json_text = response_text[start:end]
-                return json.loads(json_text)
-            raise ValueError(f"Could not parse JSON from response: {response_text}")
+        return _json_loads(response_text)
+    except ValueError:
+        pass
+    
+    # Prefer a code block's contents, so braces in surrounding prose are ignored
+    match = _FENCED_JSON_RE.search(response_text) or _JSON_RE.search(response_text)
+    if match is None:
+        raise ValueError(f"Could not parse JSON from response: {response_text}")
+    return _json_loads(match.group(1))
 
 
 def format_extraction_result(data: dict) -> str: